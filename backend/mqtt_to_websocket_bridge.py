@@ -15,19 +15,25 @@ Features:
 """
 
 import asyncio
-import json
+import math
+import threading
 import time
 import logging
-import threading
+from array import array
+from functools import lru_cache
 from typing import Dict, Any, Optional
-from collections import defaultdict, deque
+from collections import deque
+import orjson
 import paho.mqtt.client as mqtt
-from websocket_server import get_api_instance
+from websocket_server import get_api_instance, run_event_loop
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Statuses published by the vision node; anything else is counted as UNKNOWN
+KNOWN_STATUSES = ("MOVE_LEFT", "MOVE_RIGHT", "CENTERED", "NO_FACE", "UNKNOWN")
+
 class MQTTToWebSocketBridge:
     """Enhanced MQTT to WebSocket bridge with analytics"""
     
@@ -46,23 +52,54 @@ class MQTTToWebSocketBridge:
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
         
+        # Drive the MQTT socket from the asyncio loop instead of paho's thread
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._misc_task: Optional[asyncio.Task] = None
+        
+        # Raw (topic, payload) pairs waiting for the consumer task
+        self._inbound: asyncio.Queue = asyncio.Queue(maxsize=10_000)
+        self.dropped_messages = 0
+        
         # Analytics and tracking
         self.message_count = 0
-        self.status_counts = defaultdict(int)
+        self.status_counts = dict.fromkeys(KNOWN_STATUSES, 0)
         self.confidence_history = deque(maxlen=100)
-        self.message_timestamps = deque(maxlen=1000)
+        self._confidence_sum = 0.0
         self.last_message_time = 0
         
+        # Per-second message counters for the last 60 s
+        self._msg_buckets = array("I", [0]) * 60
+        self._bucket_epoch = int(time.time())
+        
+        # Movement rate as an EWMA with a 10 s time constant
+        self._move_ewma = 0.0
+        self._move_last_t = time.time()
+        
         # Performance metrics
         self.start_time = time.time()
         self.connection_drops = 0
         self.reconnect_attempts = 0
         
+        # Reconnect backoff; the run loop waits on _disconnected instead of polling
+        self.reconnect_min_delay = 1
+        self.reconnect_max_delay = 30
+        self._disconnected = asyncio.Event()
+        
         # Enhanced features
-        self.movement_patterns = defaultdict(list)
-        self.face_lock_sessions = []
+        self.face_lock_sessions = deque(maxlen=256)  # Recent sessions only
+        self.session_count = 0
+        self.session_duration_sum = 0.0
         self.current_session = None
         
+        # get_analytics() response cache: (monotonic time built, response)
+        self.analytics_ttl = 1.0
+        self._analytics_cache = (0.0, None)
+        
         # WebSocket API reference
         self.websocket_api = None
         
@@ -71,9 +108,8 @@ class MQTTToWebSocketBridge:
         if rc == 0:
             logger.info(f"Connected to MQTT broker at {self.broker_host}:{self.broker_port}")
             
-            # Subscribe to topics
-            client.subscribe(self.movement_topic)
-            client.subscribe(self.heartbeat_topic)
+            # Subscribe to both topics in a single SUBSCRIBE packet
+            client.subscribe([(self.movement_topic, 0), (self.heartbeat_topic, 0)])
             logger.info(f"Subscribed to topics: {self.movement_topic}, {self.heartbeat_topic}")
             
             # Reset reconnection counter
@@ -86,30 +122,84 @@ class MQTTToWebSocketBridge:
         """MQTT disconnection callback"""
         logger.warning(f"Disconnected from MQTT broker. Return code: {rc}")
         self.connection_drops += 1
+        self._disconnected.set()
+        
+    def _call_on_loop(self, callback, *args):
+        """Run callback on the event loop, hopping threads when called from connect()"""
+        if threading.get_ident() == self._loop_thread:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+            
+    def _on_socket_open(self, client, userdata, sock):
+        """Register the MQTT socket with the event loop"""
+        self._call_on_loop(self._add_socket_reader, sock.fileno())
+        
+    def _on_socket_close(self, client, userdata, sock):
+        """Unregister the MQTT socket from the event loop"""
+        self._call_on_loop(self._remove_socket_reader, sock.fileno())
+        
+    def _on_socket_register_write(self, client, userdata, sock):
+        """Flush pending MQTT writes when the socket becomes writable"""
+        self._call_on_loop(self._loop.add_writer, sock.fileno(), client.loop_write)
+        
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        """Stop watching the MQTT socket for writability"""
+        self._call_on_loop(self._loop.remove_writer, sock.fileno())
         
+    def _add_socket_reader(self, fd: int):
+        """Watch the MQTT socket for reads and start housekeeping"""
+        self._loop.add_reader(fd, self.client.loop_read)
+        self._misc_task = self._loop.create_task(self._misc_loop())
+        
+    def _remove_socket_reader(self, fd: int):
+        """Stop watching the MQTT socket and its housekeeping"""
+        self._loop.remove_reader(fd)
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
+            
+    async def _misc_loop(self):
+        """Run paho's keepalive and retry housekeeping once per second"""
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+            
     def _on_message(self, client, userdata, msg):
-        """MQTT message callback with enhanced processing"""
+        """MQTT message callback: hand the raw payload to the consumer task"""
+        try:
+            # Stamp arrival here so queueing delay doesn't skew the rates
+            self._inbound.put_nowait((msg.topic, msg.payload, time.time()))
+        except asyncio.QueueFull:
+            self.dropped_messages += 1
+            
+    async def _consumer(self):
+        """Parse, enrich and forward queued MQTT messages"""
+        while True:
+            topic, raw, timestamp = await self._inbound.get()
+            await self._handle_message(topic, raw, timestamp)
+            
+    async def _handle_message(self, topic: str, raw: bytes, timestamp: float):
+        """Process one MQTT message with enhanced processing"""
         try:
             # Parse message
-            topic = msg.topic
-            payload = json.loads(msg.payload.decode())
-            timestamp = time.time()
+            payload = orjson.loads(raw)
             
             # Update tracking
             self.message_count += 1
-            self.message_timestamps.append(timestamp)
+            second = int(timestamp)
+            if second != self._bucket_epoch:
+                self._advance_buckets(timestamp)
+            self._msg_buckets[second % 60] += 1
             self.last_message_time = timestamp
             
             # Process based on topic
             if topic == self.movement_topic:
                 self._process_movement_message(payload, timestamp)
-            elif topic == self.heartbeat_topic:
-                self._process_heartbeat_message(payload, timestamp)
                 
             # Send to WebSocket clients
-            asyncio.create_task(self._send_to_websocket(payload, topic))
+            await self._send_to_websocket(payload)
             
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Failed to parse MQTT message: {e}")
         except Exception as e:
             logger.error(f"Error processing MQTT message: {e}")
@@ -118,98 +208,88 @@ class MQTTToWebSocketBridge:
         """Process movement detection messages with analytics"""
         status = payload.get("status", "UNKNOWN")
         confidence = payload.get("confidence", 0.0)
+        status_counts = self.status_counts
+        confidence_history = self.confidence_history
+        session = self.current_session
         
         # Update status counts
-        self.status_counts[status] += 1
+        status_counts[status if status in status_counts else "UNKNOWN"] += 1
         
-        # Track confidence history
+        # Track confidence history with a running sum
         if confidence > 0:
-            self.confidence_history.append(confidence)
+            if len(confidence_history) == confidence_history.maxlen:
+                self._confidence_sum -= confidence_history[0]
+            confidence_history.append(confidence)
+            self._confidence_sum += confidence
             
         # Track movement patterns
-        if status in ["MOVE_LEFT", "MOVE_RIGHT"]:
-            self.movement_patterns[status].append(timestamp)
+        if status == "MOVE_LEFT" or status == "MOVE_RIGHT":
+            # Count-based decay: each movement adds 1/tau, so bursts are not undercounted
+            dt = max(0.0, timestamp - self._move_last_t)
+            self._move_ewma = self._move_ewma * math.exp(-dt / 10.0) + 1 / 10.0
+            self._move_last_t = timestamp
             
         # Track face lock sessions
         if status != "NO_FACE":
-            if self.current_session is None:
+            if session is None:
                 # Start new session
                 self.current_session = {
                     "start_time": timestamp,
-                    "status_changes": [(timestamp, status)],
                     "max_confidence": confidence
                 }
-            else:
+            elif confidence > session["max_confidence"]:
                 # Update current session
-                self.current_session["status_changes"].append((timestamp, status))
-                self.current_session["max_confidence"] = max(
-                    self.current_session["max_confidence"], confidence
-                )
-        else:
+                session["max_confidence"] = confidence
+        elif session is not None:
             # End current session
-            if self.current_session is not None:
-                self.current_session["end_time"] = timestamp
-                self.current_session["duration"] = timestamp - self.current_session["start_time"]
-                self.face_lock_sessions.append(self.current_session)
-                self.current_session = None
-                
-        # Enhanced message enrichment
-        payload["processed_at"] = timestamp
-        payload["message_sequence"] = self.message_count
-        payload["avg_confidence_recent"] = self._get_recent_avg_confidence()
-        payload["movement_rate"] = self._calculate_movement_rate()
-        
-    def _process_heartbeat_message(self, payload: Dict[str, Any], timestamp: float):
-        """Process heartbeat messages with system metrics"""
-        # Enrich heartbeat with bridge metrics
-        payload["bridge_metrics"] = {
-            "messages_processed": self.message_count,
-            "connection_drops": self.connection_drops,
-            "uptime": timestamp - self.start_time,
-            "messages_per_second": self._calculate_message_rate()
-        }
-        
+            session["end_time"] = timestamp
+            session["duration"] = timestamp - session["start_time"]
+            self.face_lock_sessions.append(session)
+            self.session_count += 1
+            self.session_duration_sum += session["duration"]
+            self.current_session = None
+            
     def _get_recent_avg_confidence(self) -> float:
         """Calculate average confidence from recent messages"""
         if not self.confidence_history:
             return 0.0
-        return sum(self.confidence_history) / len(self.confidence_history)
+        return self._confidence_sum / len(self.confidence_history)
         
-    def _calculate_movement_rate(self) -> float:
-        """Calculate recent movement rate (movements per second)"""
-        if not self.movement_patterns:
-            return 0.0
+    def _advance_buckets(self, now: float):
+        """Zero the per-second message buckets that expired since the last update"""
+        second = int(now)
+        elapsed = second - self._bucket_epoch
+        if elapsed <= 0:
+            return
             
-        recent_time = time.time() - 10  # Last 10 seconds
-        total_movements = 0
+        buckets = self._msg_buckets
+        size = len(buckets)
+        if elapsed >= size:
+            buckets[:] = array("I", [0]) * size
+        else:
+            for sec in range(self._bucket_epoch + 1, second + 1):
+                buckets[sec % size] = 0
+                
+        self._bucket_epoch = second
         
-        for status, timestamps in self.movement_patterns.items():
-            recent_movements = [t for t in timestamps if t > recent_time]
-            total_movements += len(recent_movements)
-            
-        return total_movements / 10.0  # movements per second
+    def _calculate_movement_rate(self) -> float:
+        """Calculate recent movement rate (movements per second)"""
+        # Decay the estimate for the time since the last movement
+        idle = max(0.0, time.time() - self._move_last_t)
+        return self._move_ewma * math.exp(-idle / 10.0)
         
     def _calculate_message_rate(self) -> float:
         """Calculate overall message rate"""
-        if not self.message_timestamps:
-            return 0.0
-            
-        # Calculate rate over last minute
-        one_minute_ago = time.time() - 60
-        recent_messages = [t for t in self.message_timestamps if t > one_minute_ago]
-        return len(recent_messages) / 60.0
+        self._advance_buckets(time.time())
+        return sum(self._msg_buckets) / 60.0  # Last minute
         
-    async def _send_to_websocket(self, payload: Dict[str, Any], topic: str):
+    async def _send_to_websocket(self, payload: Dict[str, Any]):
         """Send processed message to WebSocket clients"""
         try:
             # Get WebSocket API instance
             if self.websocket_api is None:
                 self.websocket_api = get_api_instance()
                 
-            # Add topic information
-            payload["mqtt_topic"] = topic
-            payload["bridge_enhanced"] = True
-            
             # Send to WebSocket clients
             await self.websocket_api.send_tracking_update(payload)
             
@@ -217,10 +297,15 @@ class MQTTToWebSocketBridge:
             logger.error(f"Error sending to WebSocket: {e}")
             
     def get_analytics(self) -> Dict[str, Any]:
-        """Get comprehensive analytics data"""
+        """Get comprehensive analytics data (cached for analytics_ttl seconds)"""
+        now = time.monotonic()
+        built_at, cached = self._analytics_cache
+        if cached is not None and now - built_at < self.analytics_ttl:
+            # Shallow copy per caller; the nested sections are shared, read-only
+            return dict(cached)
+            
         current_time = time.time()
-        
-        return {
+        analytics = {
             "message_statistics": {
                 "total_messages": self.message_count,
                 "messages_per_second": self._calculate_message_rate(),
@@ -232,36 +317,36 @@ class MQTTToWebSocketBridge:
                 "confidence_samples": len(self.confidence_history)
             },
             "movement_patterns": {
-                "left_movements": len(self.movement_patterns["MOVE_LEFT"]),
-                "right_movements": len(self.movement_patterns["MOVE_RIGHT"]),
+                "left_movements": self.status_counts["MOVE_LEFT"],
+                "right_movements": self.status_counts["MOVE_RIGHT"],
                 "movement_rate": self._calculate_movement_rate()
             },
             "session_statistics": {
-                "total_sessions": len(self.face_lock_sessions),
+                "total_sessions": self.session_count,
                 "active_session": self.current_session is not None,
                 "average_session_duration": self._calculate_avg_session_duration()
             },
             "bridge_metrics": {
                 "uptime": current_time - self.start_time,
                 "connection_drops": self.connection_drops,
-                "reconnect_attempts": self.reconnect_attempts
+                "reconnect_attempts": self.reconnect_attempts,
+                "dropped_messages": self.dropped_messages
             }
         }
+        self._analytics_cache = (now, analytics)
+        return dict(analytics)
         
     def _calculate_avg_session_duration(self) -> float:
         """Calculate average face lock session duration"""
-        if not self.face_lock_sessions:
+        if not self.session_count:
             return 0.0
-            
-        durations = [s.get("duration", 0) for s in self.face_lock_sessions]
-        return sum(durations) / len(durations)
+        return self.session_duration_sum / self.session_count
         
     def connect(self):
         """Connect to MQTT broker"""
         try:
             logger.info(f"Connecting to MQTT broker at {self.broker_host}:{self.broker_port}")
             self.client.connect(self.broker_host, self.broker_port, 60)
-            self.client.loop_start()
             return True
         except Exception as e:
             logger.error(f"Failed to connect to MQTT broker: {e}")
@@ -270,47 +355,64 @@ class MQTTToWebSocketBridge:
     def disconnect(self):
         """Disconnect from MQTT broker"""
         try:
-            self.client.loop_stop()
             self.client.disconnect()
             logger.info("Disconnected from MQTT broker")
         except Exception as e:
             logger.error(f"Error disconnecting from MQTT broker: {e}")
             
-    def run_forever(self):
-        """Run the bridge forever with automatic reconnection"""
-        while True:
-            try:
-                if not self.connect():
-                    logger.error("Failed to connect, retrying in 5 seconds...")
-                    time.sleep(5)
-                    self.reconnect_attempts += 1
-                    continue
-                    
-                # Keep the main thread alive
-                while True:
-                    time.sleep(1)
-                    
-                    # Check connection health
-                    if not self.client.is_connected():
+    async def run(self):
+        """Run the bridge on the current event loop with automatic reconnection"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        consumer = asyncio.create_task(self._consumer())
+        
+        try:
+            while True:
+                try:
+                    self._disconnected.clear()
+                    # DNS lookup and TCP connect block, so keep them off the loop
+                    if await self._loop.run_in_executor(None, self.connect):
+                        # Sleep until _on_disconnect reports the connection lost
+                        await self._disconnected.wait()
                         logger.warning("MQTT connection lost, attempting to reconnect...")
-                        break
                         
-            except KeyboardInterrupt:
-                logger.info("Shutting down MQTT to WebSocket bridge...")
-                break
-            except Exception as e:
-                logger.error(f"Unexpected error: {e}")
-                time.sleep(5)
-                
-        self.disconnect()
-
-# Global instance
-bridge_instance = MQTTToWebSocketBridge()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Unexpected error: {e}")
+                    
+                # Exponential backoff, reset by a successful CONNACK; the capped
+                # exponent keeps a float min delay from overflowing in long outages
+                delay = min(
+                    self.reconnect_max_delay,
+                    self.reconnect_min_delay * 2 ** min(self.reconnect_attempts, 16)
+                )
+                self.reconnect_attempts += 1
+                logger.info(f"Reconnecting in {delay} seconds...")
+                await asyncio.sleep(delay)
+        finally:
+            consumer.cancel()
+            self.disconnect()
+            
+    async def serve(self):
+        """Run the bridge and the WebSocket server together on one event loop"""
+        if self.websocket_api is None:
+            self.websocket_api = get_api_instance()
+            
+        await asyncio.gather(self.websocket_api.start_server(), self.run())
+        
+    def run_forever(self):
+        """Run the bridge and WebSocket server until interrupted"""
+        try:
+            run_event_loop(self.serve())
+        except KeyboardInterrupt:
+            logger.info("Shutting down MQTT to WebSocket bridge...")
 
+@lru_cache(maxsize=1)
 def get_bridge_instance():
-    """Get the global bridge instance"""
-    return bridge_instance
+    """Get the shared bridge instance, created on first use"""
+    return MQTTToWebSocketBridge()
 
 if __name__ == "__main__":
     # Run the bridge
-    bridge_instance.run_forever()
+    get_bridge_instance().run_forever()
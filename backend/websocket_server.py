@@ -16,19 +16,43 @@ Features:
 
 import asyncio
 import websockets
-import json
+from websockets import broadcast as ws_broadcast
+import numpy as np
+import orjson
 import time
 import logging
-from typing import Dict, List, Set
-from dataclasses import dataclass, asdict
-import threading
-from collections import deque
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+from dataclasses import dataclass
+
+try:
+    import msgpack
+except ImportError:  # MessagePack frames are opt-in; JSON works without it
+    msgpack = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@dataclass
+def _dumps(data) -> str:
+    """Serialize data to a JSON text frame (non-str keys stringified like json.dumps)"""
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode()
+
+def _packb(data) -> bytes:
+    """Serialize data to a MessagePack binary frame"""
+    return msgpack.packb(data, use_bin_type=True)
+
+# Frame encoders clients can pick with ?enc=<name>; JSON is the fallback
+FRAME_ENCODERS = {"json": _dumps}
+if msgpack is not None:
+    FRAME_ENCODERS["msgpack"] = _packb
+
+def _fields(obj) -> dict:
+    """Shallow field dict of a slotted dataclass (no recursive copy like asdict)"""
+    return {name: getattr(obj, name) for name in obj.__slots__}
+
+@dataclass(slots=True)
 class TrackingEvent:
     """Face tracking event data structure"""
     timestamp: float
@@ -38,13 +62,9 @@ class TrackingEvent:
     face_position: tuple = (0, 0)
     lock_state: str = "SEARCHING"
     fps: float = 0.0
-    actions_detected: List[str] = None
-    
-    def __post_init__(self):
-        if self.actions_detected is None:
-            self.actions_detected = []
+    actions_detected: Tuple[str, ...] = ()
 
-@dataclass
+@dataclass(slots=True)
 class SystemMetrics:
     """System performance metrics"""
     cpu_usage: float = 0.0
@@ -61,15 +81,33 @@ class WebSocketAPI:
         self.host = host
         self.port = port
         self.clients: Set[websockets.WebSocketServerProtocol] = set()
+        self.msgpack_clients: Set[websockets.WebSocketServerProtocol] = set()
+        
+        # Broadcasts skip clients whose write buffer exceeds this many bytes
+        self.client_buffer_limit = 64 * 1024
+        self.dropped_frames = 0
+        
+        # Tracking updates coalesced into one tracking_batch frame per interval
+        self.batch_interval = 0.016
+        self._outbound: List[dict] = []
+        
         self.current_event = TrackingEvent(
             timestamp=time.time(),
             status="NO_FACE",
             confidence=0.0
         )
         self.metrics = SystemMetrics()
-        self.event_history = deque(maxlen=100)  # Keep last 100 events
+        
+        # Last 100 events as a struct-of-arrays ring buffer
+        self.history_size = 100
+        self._hist_ts = np.zeros(self.history_size, dtype=np.float64)
+        self._hist_conf = np.zeros(self.history_size, dtype=np.float64)
+        self._hist_servo = np.zeros(self.history_size, dtype=np.int16)
+        self._hist_status = [""] * self.history_size
+        self._hist_head = 0
+        self._hist_len = 0
+        
         self.start_time = time.time()
-        self._lock = threading.Lock()
         
         # Enhanced features
         self.action_counts = {}
@@ -77,111 +115,150 @@ class WebSocketAPI:
         self.last_status_change = time.time()
         self.total_faces_detected = 0
         
-    async def register_client(self, websocket):
-        """Register a new client connection"""
-        self.clients.add(websocket)
-        logger.info(f"Client connected. Total clients: {len(self.clients)}")
+        # Serialized initial_state snapshots per encoding, rebuilt only after state changes
+        self._initial_state_frames: Dict[str, object] = {}
         
-        # Send current state immediately
-        await self.send_to_client(websocket, {
-            "type": "initial_state",
-            "event": asdict(self.current_event),
-            "metrics": asdict(self.metrics),
-            "history": [asdict(e) for e in list(self.event_history)[-10:]]
-        })
+    async def register_client(self, websocket, encoding: str = "json"):
+        """Register a new client connection using the negotiated frame encoding"""
+        if encoding == "msgpack":
+            self.msgpack_clients.add(websocket)
+            
+        # Send current state before the client joins broadcasts
+        frame = self._initial_state_frames.get(encoding)
+        if frame is None:
+            frame = FRAME_ENCODERS[encoding]({
+                "type": "initial_state",
+                "event": _fields(self.current_event),
+                "metrics": _fields(self.metrics),
+                "history": [_fields(e) for e in self._history_events(10)]
+            })
+            self._initial_state_frames[encoding] = frame
+        await self.send_to_client(websocket, frame)
+        
+        self.clients.add(websocket)
+        logger.info(f"Client connected ({encoding}). Total clients: {len(self.clients)}")
         
     async def unregister_client(self, websocket):
         """Unregister a client connection"""
         self.clients.discard(websocket)
+        self.msgpack_clients.discard(websocket)
         logger.info(f"Client disconnected. Total clients: {len(self.clients)}")
         
     async def send_to_client(self, websocket, data):
-        """Send data to a specific client"""
+        """Send data (dict or pre-serialized frame) to a specific client"""
+        if isinstance(data, (str, bytes)):
+            frame = data
+        elif websocket in self.msgpack_clients:
+            frame = _packb(data)
+        else:
+            frame = _dumps(data)
         try:
-            await websocket.send(json.dumps(data))
+            await websocket.send(frame)
         except websockets.exceptions.ConnectionClosed:
             await self.unregister_client(websocket)
             
-    async def broadcast(self, data):
+    async def broadcast(self, data: dict):
         """Broadcast data to all connected clients"""
         if not self.clients:
             return
             
-        disconnected = set()
+        # Slow clients miss frames instead of buffering them
+        limit = self.client_buffer_limit
+        json_clients, msgpack_clients = [], []
         for client in self.clients:
-            try:
-                await client.send(json.dumps(data))
-            except websockets.exceptions.ConnectionClosed:
-                disconnected.add(client)
+            if client.transport.get_write_buffer_size() >= limit:
+                self.dropped_frames += 1
+            elif client in self.msgpack_clients:
+                msgpack_clients.append(client)
+            else:
+                json_clients.append(client)
                 
-        # Remove disconnected clients
-        for client in disconnected:
-            await self.unregister_client(client)
-            
+        # Serialize once per encoding, all before writing so an encode error
+        # sends nothing; websockets builds each frame once for every transport
+        frames = []
+        if json_clients:
+            frames.append((json_clients, _dumps(data)))
+        if msgpack_clients:
+            frames.append((msgpack_clients, _packb(data)))
+        for clients, frame in frames:
+            ws_broadcast(clients, frame)
+        
     def update_tracking_event(self, event_data: dict):
-        """Update current tracking event from MQTT data"""
-        with self._lock:
-            # Update current event
-            self.current_event.timestamp = time.time()
-            self.current_event.status = event_data.get("status", "NO_FACE")
-            self.current_event.confidence = event_data.get("confidence", 0.0)
-            
-            # Track status changes for analytics
-            if self.current_event.status != getattr(self, '_last_status', 'NO_FACE'):
-                self._last_status = self.current_event.status
-                self.last_status_change = time.time()
-                
-                # Update status duration tracking
-                status_key = self.current_event.status
-                if status_key not in self.status_duration:
-                    self.status_duration[status_key] = 0
-                self.status_duration[status_key] += 1
-                
-            # Add to history
-            self.event_history.append(TrackingEvent(**asdict(self.current_event)))
+        """Update current tracking event from MQTT data (call from the server loop)"""
+        self._initial_state_frames.clear()
+        
+        # Update current event
+        self.current_event.timestamp = time.time()
+        self.current_event.status = event_data.get("status", "NO_FACE")
+        self.current_event.confidence = event_data.get("confidence", 0.0)
+        
+        # Track status changes for analytics
+        if self.current_event.status != getattr(self, '_last_status', 'NO_FACE'):
+            self._last_status = self.current_event.status
+            self.last_status_change = time.time()
             
-            # Update metrics
-            if self.current_event.status != "NO_FACE":
-                self.total_faces_detected += 1
-                self.metrics.faces_detected = self.total_faces_detected
-                
-    def update_metrics(self, **kwargs):
-        """Update system metrics"""
-        with self._lock:
-            for key, value in kwargs.items():
-                if hasattr(self.metrics, key):
-                    setattr(self.metrics, key, value)
+            # Update status duration tracking
+            status_key = self.current_event.status
+            if status_key not in self.status_duration:
+                self.status_duration[status_key] = 0
+            self.status_duration[status_key] += 1
             
-            # Update uptime
-            self.metrics.uptime = time.time() - self.start_time
+        # Add to history
+        head = self._hist_head
+        self._hist_ts[head] = self.current_event.timestamp
+        self._hist_conf[head] = self.current_event.confidence
+        self._hist_servo[head] = self.current_event.servo_angle
+        self._hist_status[head] = self.current_event.status
+        self._hist_head = (head + 1) % self.history_size
+        self._hist_len = min(self._hist_len + 1, self.history_size)
+        
+        # Update metrics
+        if self.current_event.status != "NO_FACE":
+            self.total_faces_detected += 1
+            self.metrics.faces_detected = self.total_faces_detected
             
+    def update_metrics(self, **kwargs):
+        """Update system metrics (call from the server loop)"""
+        self._initial_state_frames.clear()
+        
+        for key, value in kwargs.items():
+            if hasattr(self.metrics, key):
+                setattr(self.metrics, key, value)
+        
+        # Update uptime
+        self.metrics.uptime = time.time() - self.start_time
+        
     async def send_tracking_update(self, event_data: dict):
-        """Send tracking update to all clients"""
+        """Queue a tracking update for the next batch broadcast"""
         self.update_tracking_event(event_data)
-        
-        # Prepare enhanced message
-        message = {
+        if not self.clients:
+            return
+            
+        # Snapshot state, since the batch is serialized after later events
+        self._outbound.append({
             "type": "tracking_update",
-            "event": asdict(self.current_event),
-            "metrics": asdict(self.metrics),
+            "event": _fields(self.current_event),
+            "metrics": _fields(self.metrics),
             "analytics": {
                 "status_distribution": dict(self.status_duration),
-                "total_events": len(self.event_history),
+                "total_events": self._hist_len,
                 "average_confidence": self._calculate_avg_confidence()
             }
-        }
-        
-        await self.broadcast(message)
+        })
         
     async def send_metrics_update(self):
         """Send periodic metrics update"""
         self.update_metrics()
         
+        # Uptime changes every tick, so only skip the work when nobody listens
+        if not self.clients:
+            return
+            
         message = {
             "type": "metrics_update",
-            "metrics": asdict(self.metrics),
+            "metrics": _fields(self.metrics),
             "performance": {
-                "events_per_second": len(self.event_history) / max(1, self.metrics.uptime),
+                "events_per_second": self._hist_len / max(1, self.metrics.uptime),
                 "client_count": len(self.clients),
                 "memory_efficiency": self._calculate_memory_efficiency()
             }
@@ -191,31 +268,48 @@ class WebSocketAPI:
         
     def _calculate_avg_confidence(self) -> float:
         """Calculate average confidence from recent events"""
-        if not self.event_history:
+        count = min(self._hist_len, 20)  # Last 20 events
+        if count == 0:
             return 0.0
-        recent_events = list(self.event_history)[-20:]  # Last 20 events
-        confidences = [e.confidence for e in recent_events if e.confidence > 0]
-        return sum(confidences) / len(confidences) if confidences else 0.0
+        recent = self._hist_conf.take(
+            np.arange(self._hist_head - count, self._hist_head), mode="wrap"
+        )
+        recent = recent[recent > 0]
+        return float(recent.mean()) if recent.size else 0.0
+        
+    def _history_events(self, count: Optional[int] = None) -> List[TrackingEvent]:
+        """Materialize the most recent history entries, oldest first"""
+        count = self._hist_len if count is None else min(count, self._hist_len)
+        events = []
+        for offset in range(count, 0, -1):
+            i = (self._hist_head - offset) % self.history_size
+            events.append(TrackingEvent(
+                timestamp=float(self._hist_ts[i]),
+                status=self._hist_status[i],
+                confidence=float(self._hist_conf[i]),
+                servo_angle=int(self._hist_servo[i])
+            ))
+        return events
         
     def _calculate_memory_efficiency(self) -> float:
         """Calculate memory efficiency metric"""
         # Simple heuristic based on history size and max size
-        return len(self.event_history) / 100.0  # Percentage of buffer used
+        return self._hist_len / self.history_size  # Percentage of buffer used
         
     async def handle_client_message(self, websocket, message):
         """Handle incoming messages from clients"""
         try:
-            data = json.loads(message)
+            data = orjson.loads(message)
             msg_type = data.get("type")
             
             if msg_type == "request_history":
                 # Send historical data
                 history_data = {
                     "type": "history_response",
-                    "history": [asdict(e) for e in list(self.event_history)],
+                    "history": [_fields(e) for e in self._history_events()],
                     "analytics": {
                         "status_distribution": dict(self.status_duration),
-                        "total_events": len(self.event_history)
+                        "total_events": self._hist_len
                     }
                 }
                 await self.send_to_client(websocket, history_data)
@@ -224,11 +318,11 @@ class WebSocketAPI:
                 # Send detailed metrics
                 metrics_data = {
                     "type": "metrics_response",
-                    "metrics": asdict(self.metrics),
+                    "metrics": _fields(self.metrics),
                     "analytics": {
                         "average_confidence": self._calculate_avg_confidence(),
                         "memory_efficiency": self._calculate_memory_efficiency(),
-                        "events_per_second": len(self.event_history) / max(1, self.metrics.uptime)
+                        "events_per_second": self._hist_len / max(1, self.metrics.uptime)
                     }
                 }
                 await self.send_to_client(websocket, metrics_data)
@@ -237,12 +331,20 @@ class WebSocketAPI:
                 # Respond to ping for latency measurement
                 await self.send_to_client(websocket, {"type": "pong", "timestamp": time.time()})
                 
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             logger.warning(f"Invalid JSON received from client: {message}")
             
+    def _negotiate_encoding(self, path: str) -> str:
+        """Pick the frame encoding from the ?enc= query parameter"""
+        encoding = parse_qs(urlsplit(path or "").query).get("enc", ["json"])[0]
+        if encoding not in FRAME_ENCODERS:
+            logger.warning(f"Frame encoding '{encoding}' unavailable, falling back to json")
+            return "json"
+        return encoding
+        
     async def client_handler(self, websocket, path):
         """Handle individual client connection"""
-        await self.register_client(websocket)
+        await self.register_client(websocket, self._negotiate_encoding(path))
         try:
             async for message in websocket:
                 await self.handle_client_message(websocket, message)
@@ -261,29 +363,73 @@ class WebSocketAPI:
                 logger.error(f"Error in metrics loop: {e}")
                 await asyncio.sleep(1)
                 
+    async def batch_loop(self):
+        """Flush coalesced tracking updates once per batch interval"""
+        while True:
+            await asyncio.sleep(self.batch_interval)
+            if not self._outbound:
+                continue
+                
+            events, self._outbound = self._outbound, []
+            try:
+                await self.broadcast({"type": "tracking_batch", "events": events})
+            except Exception as e:
+                # Drop only the events that fail to encode, not the whole window
+                encodable = [event for event in events if self._is_encodable(event)]
+                if len(encodable) == len(events):
+                    # Not an encoding failure, so filtering can't save the batch
+                    logger.error(f"Error in batch loop, lost {len(events)} events: {e}")
+                    continue
+                    
+                logger.error(
+                    f"Error in batch loop, dropping {len(events) - len(encodable)} "
+                    f"unencodable of {len(events)} events: {e}"
+                )
+                if encodable:
+                    try:
+                        await self.broadcast({"type": "tracking_batch", "events": encodable})
+                    except Exception as e:
+                        logger.error(f"Error in batch loop, lost {len(encodable)} events: {e}")
+
+    def _is_encodable(self, data) -> bool:
+        """Check that every available frame encoder can serialize data"""
+        try:
+            for encode in FRAME_ENCODERS.values():
+                encode(data)
+        except Exception:
+            return False
+        return True
+                
     async def start_server(self):
         """Start the WebSocket server"""
         logger.info(f"Starting WebSocket server on {self.host}:{self.port}")
         
-        # Start metrics update loop
+        # Start metrics update and tracking batch loops
         asyncio.create_task(self.metrics_loop())
+        asyncio.create_task(self.batch_loop())
         
         # Start WebSocket server
         async with websockets.serve(self.client_handler, self.host, self.port):
             logger.info(f"WebSocket server running on ws://{self.host}:{self.port}")
             await asyncio.Future()  # Run forever
 
-# Global instance for external access
-api_instance = WebSocketAPI()
-
+@lru_cache(maxsize=1)
 def get_api_instance():
-    """Get the global API instance"""
-    return api_instance
+    """Get the shared API instance, created on first use"""
+    return WebSocketAPI()
 
 async def send_tracking_update(event_data: dict):
     """Convenience function to send tracking updates"""
-    await api_instance.send_tracking_update(event_data)
+    await get_api_instance().send_tracking_update(event_data)
+
+def run_event_loop(main):
+    """Run a coroutine on uvloop when it is installed, else on the default asyncio loop"""
+    try:
+        import uvloop
+    except ImportError:  # uvloop is unavailable on Windows
+        return asyncio.run(main)
+    return uvloop.run(main)
 
 if __name__ == "__main__":
     # Run the server
-    asyncio.run(api_instance.start_server())
+    run_event_loop(get_api_instance().start_server())